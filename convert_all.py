@@ -30,14 +30,33 @@
 
 from osgeo import gdal
 import argparse
+import cProfile
 import csv
 import datetime
+import errno
+import functools
+import itertools
 import os
+import pstats
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import traceback
 import ntv2_to_gtiff
 import vertoffset_grid_to_gtiff
+from dataclasses import dataclass
+from multiprocessing import Pool
+from typing import Optional
 
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
 
-def get_args():
+
+def get_args(argv=None):
     parser = argparse.ArgumentParser(
         description='Convert proj-datumgrid to GeoTIFF.')
     parser.add_argument('proj_datumgrid',
@@ -52,131 +71,516 @@ def get_args():
     parser.add_argument('--only',
                         help='Convert only mentionned grid')
 
-    return parser.parse_args()
+    parser.add_argument('--error-log',
+                        default='conversion_errors.log',
+                        help='File where to log conversion failures '
+                             '(default: conversion_errors.log)')
+
+    parser.add_argument('--profile', metavar='DIR',
+                        help='Profile the conversion functions, and write '
+                             'the statistics of each grid type to '
+                             'DIR/<type>.prof. Disables the pipelining of the '
+                             'conversion steps')
+
+    parser.add_argument('--tmpdir',
+                        default='/dev/shm' if os.path.isdir('/dev/shm') else None,
+                        help='Directory for temporary files, preferably on a '
+                             'RAM-backed filesystem (default: /dev/shm when '
+                             'available, otherwise the target directory)')
+
+    return parser.parse_args(argv)
+
+
+GRIDS_PER_BATCH = 4
+
+# A GDAL block cache of 40 MB or less is too small for the larger grids and
+# causes blocks to be decoded again and again during tiled writes.
+# The budget is shared between the worker processes, but each of them gets
+# at least MIN_CACHEMAX. init_worker() only ever raises the cache size above
+# gdal.GetCacheMax(), which is 5% of RAM by default, so these values rarely
+# take effect: only on machines with little RAM for their number of CPUs.
+DEFAULT_CACHEMAX = 512 * 1024 * 1024
+MIN_CACHEMAX = 64 * 1024 * 1024
+
+
+@dataclass(slots=True)
+class CvtArgs:
+    """ Arguments of the conversion functions of ntv2_to_gtiff and
+        vertoffset_grid_to_gtiff, as their command line parsers would
+        return them. """
+
+    source: str
+    dest: str
+    source_crs: Optional[str] = None
+    target_crs: Optional[str] = None
+    interpolation_crs: Optional[str] = None
+    description: Optional[str] = None
+    copyright: Optional[str] = None
+    datetime: Optional[str] = None
+    area_of_use: Optional[str] = None
+    # ntv2_to_gtiff specific
+    do_not_write_error_samples: bool = False
+    accuracy_unit: Optional[str] = None
+    uint16_encoding: bool = False
+    positive_longitude_shift_value: Optional[str] = None
+    # vertoffset_grid_to_gtiff specific
+    type: Optional[str] = None
+    encoding: Optional[str] = None
+    ignore_nodata: Optional[str] = None
 
 
-args = get_args()
-proj_datumgrid = args.proj_datumgrid
-target_dir = args.target_dir
+def set_horizontal_offset_args(cvt_args):
+    cvt_args.do_not_write_error_samples = False
+    cvt_args.accuracy_unit = 'unknown' if os.path.basename(cvt_args.source) in (
+        'BWTA2017.gsb') else None
+    cvt_args.uint16_encoding = False
+    cvt_args.positive_longitude_shift_value = 'east'
 
-if not os.path.exists(target_dir):
-    os.mkdir(target_dir)
 
-class Obj(object):
-    pass
+def set_geographic_to_vertical_args(cvt_args):
+    filename = os.path.basename(cvt_args.source)
+    cvt_args.type = 'GEOGRAPHIC_TO_VERTICAL'
+    cvt_args.encoding = 'int32-scale-1-1000' if filename.startswith(
+        'CGG') or filename.startswith('HT2_') else 'float32'
+    cvt_args.ignore_nodata = None
 
 
-with open(os.path.join(proj_datumgrid, 'filelist.csv')) as f:
-    reader = csv.reader(f)
-    first_line = True
-    for row in reader:
-        if first_line:
-            assert row == ['filename', 'type', 'area', 'unit', 'source_crs', 'target_crs',
-                           'interpolation_crs', 'agency_name', 'source', 'licence']
-            first_line = False
+def set_vertical_to_vertical_args(cvt_args):
+    filename = cvt_args.source
+    assert 'vertcon' in filename or '-nzvd2016.gtx' in filename
+    cvt_args.interpolation_crs = 'EPSG:4267' if 'vertcon' in filename else 'EPSG:4167'
+    cvt_args.type = 'VERTICAL_TO_VERTICAL'
+    cvt_args.encoding = 'float32'
+    cvt_args.ignore_nodata = None
+
+
+# Map the type column of filelist.csv to the conversion module and to the
+# function setting the conversion arguments specific to that type
+HANDLERS = {
+    'HORIZONTAL_OFFSET':
+        (ntv2_to_gtiff, set_horizontal_offset_args),
+    'VERTICAL_OFFSET_GEOGRAPHIC_TO_VERTICAL':
+        (vertoffset_grid_to_gtiff, set_geographic_to_vertical_args),
+    'VERTICAL_OFFSET_VERTICAL_TO_VERTICAL':
+        (vertoffset_grid_to_gtiff, set_vertical_to_vertical_args),
+}
+
+
+def index_grids(proj_datumgrid):
+    """ Return a dictionary mapping grid file names to their path in
+        the proj-datumgrid directory. """
+
+    grid_index = {}
+    for subdir in ('.', 'europe', 'north-america', 'oceania', 'world'):
+        try:
+            entries = list(os.scandir(os.path.join(proj_datumgrid, subdir)))
+        except FileNotFoundError:
             continue
-        src_filename, type, area, unit, source_crs, target_crs, interpolation_crs, agency_name, source, licence = row
+        for entry in entries:
+            # Earlier subdirectories take precedence
+            grid_index.setdefault(entry.name, entry.path)
+    return grid_index
+
+
+def init_worker(cachemax):
+    """ Configure GDAL once in each worker process. """
+
+    # Settings explicitly given in the environment take precedence.
+    # Never lower the cache size below GDAL's own default (5% of RAM).
+    if 'GDAL_CACHEMAX' not in os.environ and cachemax > gdal.GetCacheMax():
+        gdal.SetCacheMax(cachemax)
+    # There is one worker per CPU, and each of them already runs the three
+    # threads of its pipeline: more compression threads would only
+    # oversubscribe the CPUs
+    if 'GDAL_NUM_THREADS' not in os.environ:
+        gdal.SetConfigOption('GDAL_NUM_THREADS', '1')
+    # Avoid listing the (possibly large) directory of a grid each time it
+    # is opened. Side-car files are still found by probing them.
+    if 'GDAL_DISABLE_READDIR_ON_OPEN' not in os.environ:
+        gdal.SetConfigOption('GDAL_DISABLE_READDIR_ON_OPEN', 'TRUE')
+    # The CRS of the grids are resolved from the local PROJ database only.
+    # Must be set before the first PROJ context of the process is created.
+    os.environ.setdefault('PROJ_NETWORK', 'OFF')
+
+
+def prepare_row(filename, row, target_dir, overwrite, creation_datetime):
+    """ Prepare the conversion of filename, described by one row of filelist.csv.
+
+        Returns a (converter, cvt_args, status) tuple. converter is None
+        when there is nothing to convert, in which case status is a message. """
+
+    this_file_target_dir = os.path.join(target_dir, row['agency_name'])
+
+    cvt_args = CvtArgs(source=filename,
+                       dest=os.path.join(this_file_target_dir, os.path.splitext(
+                           os.path.basename(filename))[0] + ".tif"))
+
+    if os.path.exists(cvt_args.dest) and not overwrite:
+        return None, None, 'Skipping ' + cvt_args.source
+
+    if row['type'] not in HANDLERS:
+        return None, None, 'Skipping ' + filename
+    converter, set_specific_args = HANDLERS[row['type']]
+
+    cvt_args.source_crs = row['source_crs']
+    cvt_args.target_crs = row['target_crs']
+    cvt_args.description = None
+    cvt_args.copyright = "Derived from work by " + row['source'] + ". " + row['licence']
+    cvt_args.datetime = creation_datetime
+    cvt_args.area_of_use = row['area']
+    set_specific_args(cvt_args)
+
+    return converter, cvt_args, None
+
+
+def get_tmpfilename(cvt_args, tmpdir):
+    """ Return the name of the temporary file for a conversion in tmpdir. """
+
+    # Prefix with the agency name, as grids of different agencies may have
+    # the same name
+    dest_dir, dest_filename = os.path.split(cvt_args.dest)
+    return os.path.join(tmpdir, os.path.basename(dest_dir) + '_' +
+                        dest_filename + '.tmp')
+
+
+def has_room_for_tmpfiles(tmpdir, cvt_args, growing_tmpfiles=0):
+    """ Return whether tmpdir has room for the temporary file of a
+        conversion, as well as for growing_tmpfiles other temporary files
+        still being written, assumed to be of similar size. """
+
+    needed = 2 * os.path.getsize(cvt_args.source) * (1 + growing_tmpfiles)
+    return shutil.disk_usage(tmpdir).free > needed
+
+
+def is_out_of_space(exc, tmpdir, cvt_args):
+    """ Return whether exc, raised while writing the temporary file of a
+        conversion in tmpdir, is due to a lack of space in tmpdir. """
+
+    if isinstance(exc, OSError) and exc.errno == errno.ENOSPC:
+        return True
+    # GDAL write errors do not carry the errno: look at what is left
+    return not has_room_for_tmpfiles(tmpdir, cvt_args)
+
+
+def remove_file(filename):
+    """ Remove filename if it exists. """
+
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
 
-        filename = None
-        for subdir in ('.', 'europe', 'north-america', 'oceania', 'world'):
-            candidate_filename = os.path.join(proj_datumgrid, subdir, src_filename)
-            if os.path.exists(candidate_filename):
-                filename = candidate_filename
-                break
+def process_rows(jobs, target_dir, overwrite, creation_datetime,
+                 scratch_dir, fallback_dir, processes=1, profile_dir=None):
+    """ Convert a batch of grids, given as (filename, row of filelist.csv)
+        tuples.
 
+        The create / optimize / check steps of successive grids are run as
+        a pipeline of threads, so that the compression of one grid overlaps
+        with the writing of the next one. A grid is handled by a single
+        stage at a time, hence no GDAL dataset is shared between threads.
+
+        Temporary files are created in scratch_dir when it has room for
+        them, and for the ones the other workers sharing it may be writing,
+        out of a total of processes. They are created in fallback_dir
+        otherwise, or when scratch_dir runs out of space while writing them.
+
+        If profile_dir is set, the steps of each grid are instead run
+        sequentially under cProfile, and the statistics are written in that
+        directory, in a file starting with the type of the grid.
+
+        Returns a (statuses, errors) tuple, where statuses is the list of
+        status messages, and errors the list of (filename, traceback) tuples
+        of the grids whose conversion failed. """
+
+    statuses = []
+    errors = []
+
+    # Bounded queues limit the number of temporary files alive at once
+    to_create = queue.Queue(maxsize=2)
+    to_optimize = queue.Queue(maxsize=2)
+    to_check = queue.Queue(maxsize=2)
+
+    # Temporary files of this batch in the scratch directory
+    scratch_tmpfiles = set()
+
+    def count_growing_tmpfiles():
+        # Files already written show in the free space. Only the ones the
+        # other processes are writing may still grow: at most one each,
+        # among the files of the scratch directory not from this batch.
+        others = len(os.listdir(scratch_dir)) - len(scratch_tmpfiles)
+        return max(0, min(others, processes - 1))
+
+    # Jobs are [converter, tmpfilename, cvt_args, error] lists. The
+    # temporary file is only chosen when it is about to be written, as
+    # free space in the scratch directory changes as conversions go.
+    def create(job):
+        converter, _, cvt_args, _ = job
+        if scratch_dir and has_room_for_tmpfiles(scratch_dir, cvt_args, count_growing_tmpfiles()):
+            job[1] = get_tmpfilename(cvt_args, scratch_dir)
+            scratch_tmpfiles.add(job[1])
+            try:
+                converter.create_unoptimized_file(
+                    cvt_args.source, job[1], cvt_args)
+                return
+            except Exception as e:
+                # The scratch directory may have filled up meanwhile: only
+                # then try again in the fallback directory
+                if not is_out_of_space(e, scratch_dir, cvt_args):
+                    raise
+                remove_file(job[1])
+                scratch_tmpfiles.discard(job[1])
+        job[1] = get_tmpfilename(cvt_args, fallback_dir)
+        converter.create_unoptimized_file(
+            cvt_args.source, job[1], cvt_args)
+
+    def optimize(job):
+        converter, tmpfilename, cvt_args, _ = job
+        converter.generate_optimized_file(tmpfilename, cvt_args.dest)
+
+    def check(job):
+        converter, _, cvt_args, _ = job
+        converter.check(cvt_args.source, cvt_args.dest, cvt_args)
+
+    def finish(job):
+        # Must not raise, so that a job is always accounted for
+        converter, tmpfilename, cvt_args, error = job
+        try:
+            # Free space as soon as possible, as the temporary file
+            # may be in RAM. It does not exist if creation failed.
+            if tmpfilename:
+                remove_file(tmpfilename)
+                scratch_tmpfiles.discard(tmpfilename)
+            if error is not None:
+                # Do not leave a partial or unchecked grid behind, that
+                # would be skipped by the next run
+                remove_file(cvt_args.dest)
+        except Exception:
+            if error is None:
+                error = traceback.format_exc()
+        if error is None:
+            statuses.append('Processed ' + cvt_args.source)
+        else:
+            errors.append((cvt_args.source, error))
+
+    def run_step(func, job):
+        # Jobs that failed in a previous step are left untouched
+        if job[3] is None:
+            try:
+                func(job)
+            except Exception:
+                # Exceptions raised by GDAL may not be picklable
+                job[3] = traceback.format_exc()
+
+    def run_stage(func, in_queue, out_queue):
+        # Jobs and the final None are always forwarded, whatever happens,
+        # so that the next stage never waits forever.
+        try:
+            while True:
+                job = in_queue.get()
+                if job is None:
+                    break
+                try:
+                    run_step(func, job)
+                finally:
+                    if out_queue:
+                        out_queue.put(job)
+                    else:
+                        finish(job)
+        finally:
+            if out_queue:
+                out_queue.put(None)
+
+    def prepare_jobs():
+        # Yield (row, job) tuples for the grids to convert
+        for filename, row in jobs:
+            try:
+                converter, cvt_args, status = prepare_row(
+                    filename, row, target_dir, overwrite, creation_datetime)
+            except Exception:
+                errors.append((filename, traceback.format_exc()))
+                continue
+            if converter:
+                yield row, [converter, None, cvt_args, None]
+            else:
+                statuses.append(status)
+
+    if profile_dir:
+        # From Python 3.12, only one profiler can be active at a time in a
+        # process, so do not use the pipeline of threads
+        for row, job in prepare_jobs():
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                for func in (create, optimize, check):
+                    run_step(func, job)
+            finally:
+                profile.disable()
+                profile.dump_stats(os.path.join(profile_dir, '%s.%s_%s.prof' % (
+                    row['type'], row['agency_name'], os.path.basename(job[2].source))))
+                finish(job)
+        return statuses, errors
+
+    threads = [threading.Thread(target=run_stage, args=stage_args) for stage_args in (
+        (create, to_create, to_optimize),
+        (optimize, to_optimize, to_check),
+        (check, to_check, None))]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for _, job in prepare_jobs():
+            to_create.put(job)
+    finally:
+        to_create.put(None)
+        for thread in threads:
+            thread.join()
+
+    return statuses, errors
+
+
+def log_errors(error_log, errors, write):
+    """ Log the (filename, traceback) tuples of failed conversions to
+        error_log, and report each failure with write(). """
+
+    for filename, tb in errors:
+        error_log.write('Failed to convert %s\n%s\n' % (filename, tb))
+        error_log.flush()
+        write('Failed to convert ' + filename)
+
+
+def main(argv=None):
+    """ Convert the grids of proj-datumgrid, and return the exit status. """
+
+    args = get_args(argv)
+    proj_datumgrid = args.proj_datumgrid
+    target_dir = args.target_dir
+
+    filelist = os.path.join(proj_datumgrid, 'filelist.csv')
+    with open(filelist) as f:
+        reader = csv.DictReader(f)
+        assert reader.fieldnames == ['filename', 'type', 'area', 'unit', 'source_crs', 'target_crs',
+                                     'interpolation_crs', 'agency_name', 'source', 'licence']
+        rows = []
+        for row in reader:
+            # DictReader stores extra values under None, and missing ones as None
+            if None in row or None in row.values():
+                raise ValueError('%s:%d: expected %d fields' % (
+                    filelist, reader.line_num, len(reader.fieldnames)))
+            rows.append(row)
+
+    # Resolve the grids in the main process, so that workers only receive
+    # the work they have to do
+    grid_index = index_grids(proj_datumgrid)
+    jobs = []
+    for row in rows:
+        filename = grid_index.get(row['filename'])
         if not filename:
-            print('Cannot find ' + src_filename)
+            print('Cannot find ' + row['filename'])
+            continue
+        if args.only and os.path.basename(filename) != args.only:
             continue
+        jobs.append((filename, row))
 
-        this_file_target_dir = os.path.join(target_dir, agency_name)
-        if not os.path.exists(this_file_target_dir):
-            os.mkdir(this_file_target_dir)
+    # Create the target directories upfront, rather than from each worker
+    os.makedirs(target_dir, exist_ok=True)
+    for agency_name in set(row['agency_name'] for _, row in jobs):
+        os.makedirs(os.path.join(target_dir, agency_name), exist_ok=True)
 
-        if args.only:
-            if os.path.basename(filename) == args.only:
-                pass
+    # Split the grids of each agency into small batches. Batches are
+    # independent from each other and are dispatched to a pool of processes,
+    # each of them pipelining the conversion of the grids of its batch.
+    # Small batches keep all workers busy until the end of the run.
+    batches = []
+    def agency_of(job):
+        return job[1]['agency_name']
+    jobs.sort(key=agency_of)
+    for agency_name, agency_jobs in itertools.groupby(jobs, key=agency_of):
+        agency_jobs = list(agency_jobs)
+        for i in range(0, len(agency_jobs), GRIDS_PER_BATCH):
+            batches.append(agency_jobs[i:i + GRIDS_PER_BATCH])
+
+    # Temporary files go to directories specific to this run, so that no
+    # file from an interrupted run gets in the way, and that everything is
+    # cleaned up at the end
+    scratch_dir = None
+    if args.tmpdir:
+        scratch_dir = tempfile.mkdtemp(prefix='convert_all_', dir=args.tmpdir)
+    fallback_dir = tempfile.mkdtemp(prefix='convert_all_', dir=target_dir)
+
+    profile_dir = None
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
+        profile_dir = tempfile.mkdtemp(prefix='convert_all_', dir=args.profile)
+
+    # Computed once here rather than at import time, as workers re-import
+    # this module with the spawn and forkserver start methods: all grids
+    # converted in a run share the same TIFFTAG_DATETIME
+    creation_datetime = datetime.date.today().strftime("%Y:%m:%d %H:%M:%S")
+
+    processes = os.cpu_count() or 1
+    cachemax = max(DEFAULT_CACHEMAX // processes, MIN_CACHEMAX)
+
+    process = functools.partial(process_rows,
+                                target_dir=target_dir,
+                                overwrite=args.overwrite,
+                                creation_datetime=creation_datetime,
+                                scratch_dir=scratch_dir,
+                                fallback_dir=fallback_dir,
+                                processes=processes,
+                                profile_dir=profile_dir)
+
+    # Failures are logged to a file, so that they do not clutter the output,
+    # and the conversion goes on with the other grids. The log is truncated
+    # upfront, so that it never lists failures of an earlier run.
+    error_count = 0
+    try:
+        with open(args.error_log, 'w') as error_log, \
+                Pool(processes=processes,
+                     initializer=init_worker,
+                     initargs=(cachemax,)) as pool:
+            results = pool.imap_unordered(process, batches)
+            # Created once the workers are forked, as tqdm starts a thread
+            progress = None
+            if tqdm and sys.stdout.isatty():
+                progress = tqdm(total=len(jobs), desc='convert', unit='grid')
+            if progress:
+                for statuses, errors in results:
+                    progress.update(len(statuses) + len(errors))
+                    # The progress bar already accounts for converted grids
+                    for status in statuses:
+                        if not status.startswith('Processed '):
+                            progress.write(status)
+                    log_errors(error_log, errors, progress.write)
+                    error_count += len(errors)
+                progress.close()
             else:
-                continue
+                for statuses, errors in results:
+                    for status in statuses:
+                        print(status)
+                    log_errors(error_log, errors, print)
+                    error_count += len(errors)
 
-        cvt_args = Obj()
-        cvt_args.source = filename
-        cvt_args.dest = os.path.join(this_file_target_dir,os.path.splitext(
-            os.path.basename(filename))[0] + ".tif")
+        if profile_dir:
+            for grid_type in HANDLERS:
+                prefix = grid_type + '.'
+                partial_stats = [os.path.join(profile_dir, name)
+                                 for name in os.listdir(profile_dir)
+                                 if name.startswith(prefix)]
+                if partial_stats:
+                    pstats.Stats(*partial_stats).dump_stats(
+                        os.path.join(args.profile, grid_type + '.prof'))
+    finally:
+        for tmpdir in (scratch_dir, fallback_dir, profile_dir):
+            if tmpdir:
+                shutil.rmtree(tmpdir, ignore_errors=True)
 
-        if os.path.exists(cvt_args.dest) and not args.overwrite:
-            print('Skipping ' + cvt_args.source)
-            continue
+    if error_count:
+        print('%d grid(s) failed, see %s' % (error_count, args.error_log))
+        return 1
+    return 0
 
-        if type == 'HORIZONTAL_OFFSET':
-            print('Processing ' + filename)
-            cvt_args.do_not_write_error_samples = False
-            cvt_args.accuracy_unit = None
-            cvt_args.source_crs = source_crs
-            cvt_args.target_crs = target_crs
-            cvt_args.description = None
-            cvt_args.copyright = "Derived from work by " + source + ". " + licence
-            cvt_args.accuracy_unit = 'unknown' if os.path.basename(filename) in (
-                'BWTA2017.gsb') else None
-            cvt_args.uint16_encoding = False
-            cvt_args.positive_longitude_shift_value = 'east'
-            cvt_args.datetime = datetime.date.today().strftime("%Y:%m:%d %H:%M:%S")
-            cvt_args.area_of_use = area
-
-            tmpfilename = cvt_args.dest + '.tmp'
-            gdal.Unlink(tmpfilename)
-            ntv2_to_gtiff.create_unoptimized_file(
-                cvt_args.source, tmpfilename, cvt_args)
-            ntv2_to_gtiff.generate_optimized_file(tmpfilename, cvt_args.dest)
-            ntv2_to_gtiff.check(cvt_args.source, cvt_args.dest, cvt_args)
-
-            gdal.Unlink(tmpfilename)
-
-        elif type == 'VERTICAL_OFFSET_GEOGRAPHIC_TO_VERTICAL':
-            print('Processing ' + filename)
-            cvt_args.source_crs = source_crs
-            cvt_args.target_crs = target_crs
-            cvt_args.description = None
-            cvt_args.copyright = "Derived from work by " + source + ". " + licence
-            cvt_args.datetime = datetime.date.today().strftime("%Y:%m:%d %H:%M:%S")
-            cvt_args.type = 'GEOGRAPHIC_TO_VERTICAL'
-            cvt_args.encoding = 'int32-scale-1-1000' if os.path.basename(filename).startswith(
-                'CGG') or os.path.basename(filename).startswith('HT2_') else 'float32'
-            cvt_args.ignore_nodata = None
-            cvt_args.area_of_use = area
-
-            tmpfilename = cvt_args.dest + '.tmp'
-            gdal.Unlink(tmpfilename)
-            vertoffset_grid_to_gtiff.create_unoptimized_file(
-                cvt_args.source, tmpfilename, cvt_args)
-            vertoffset_grid_to_gtiff.generate_optimized_file(
-                tmpfilename, cvt_args.dest)
-            vertoffset_grid_to_gtiff.check(cvt_args.source, cvt_args.dest, cvt_args)
-
-            gdal.Unlink(tmpfilename)
-
-        elif type == 'VERTICAL_OFFSET_VERTICAL_TO_VERTICAL':
-            print('Processing ' + filename)
-            cvt_args.source_crs = source_crs
-            cvt_args.target_crs = target_crs
-            assert 'vertcon' in filename or '-nzvd2016.gtx' in filename
-            cvt_args.interpolation_crs = 'EPSG:4267' if 'vertcon' in filename else 'EPSG:4167'
-            cvt_args.description = None
-            cvt_args.copyright = "Derived from work by " + source + ". " + licence
-            cvt_args.datetime = datetime.date.today().strftime("%Y:%m:%d %H:%M:%S")
-            cvt_args.type = 'VERTICAL_TO_VERTICAL'
-            cvt_args.encoding = 'float32'
-            cvt_args.ignore_nodata = None
-            cvt_args.area_of_use = area
-
-            tmpfilename = cvt_args.dest + '.tmp'
-            gdal.Unlink(tmpfilename)
-            vertoffset_grid_to_gtiff.create_unoptimized_file(
-                cvt_args.source, tmpfilename, cvt_args)
-            vertoffset_grid_to_gtiff.generate_optimized_file(
-                tmpfilename, cvt_args.dest)
-            vertoffset_grid_to_gtiff.check(cvt_args.source, cvt_args.dest, cvt_args)
-
-            gdal.Unlink(tmpfilename)
 
-        else:
-            print('Skipping ' + filename)
+if __name__ == '__main__':
+    sys.exit(main())
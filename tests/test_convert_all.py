@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+###############################################################################
+# $Id$
+#
+#  Project:  PROJ
+#  Purpose:  Test the conversion pipeline of convert_all.py
+#
+###############################################################################
+
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# convert_all.py imports GDAL and the PROJ grid tools at module level.
+# The pipeline itself does not call them, so placeholders are enough when
+# they are not installed: the tests use their own converter below.
+for module_name in ('osgeo', 'ntv2_to_gtiff', 'vertoffset_grid_to_gtiff'):
+    try:
+        __import__(module_name)
+    except ImportError:
+        sys.modules[module_name] = types.ModuleType(module_name)
+if not hasattr(sys.modules['osgeo'], 'gdal'):
+    sys.modules['osgeo'].gdal = types.ModuleType('osgeo.gdal')
+    sys.modules['osgeo.gdal'] = sys.modules['osgeo'].gdal
+
+import convert_all
+
+
+class StubConverter(object):
+    """ Converter copying the source grid, and failing for the grids whose
+        name is in the fail_create / fail_optimize / fail_check sets. """
+
+    def __init__(self, fail_create=(), fail_optimize=(), fail_check=()):
+        self.fail_create = set(fail_create)
+        self.fail_optimize = set(fail_optimize)
+        self.fail_check = set(fail_check)
+
+    def create_unoptimized_file(self, src, tmpfilename, args):
+        if os.path.basename(src) in self.fail_create:
+            raise RuntimeError('create failed')
+        shutil.copy(src, tmpfilename)
+
+    def generate_optimized_file(self, tmpfilename, dest):
+        shutil.copy(tmpfilename, dest)
+        if os.path.basename(dest)[:-len('.tif')] + '.gsb' in self.fail_optimize:
+            raise RuntimeError('optimize failed')
+
+    def check(self, src, dest, args):
+        if os.path.basename(src) in self.fail_check:
+            raise RuntimeError('check failed')
+
+
+class TestProcessRows(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmpdir, 'source')
+        self.target_dir = os.path.join(self.tmpdir, 'target')
+        self.scratch_dir = os.path.join(self.tmpdir, 'scratch')
+        self.fallback_dir = os.path.join(self.tmpdir, 'fallback')
+        for d in (self.source_dir, os.path.join(self.target_dir, 'agency'),
+                  self.scratch_dir, self.fallback_dir):
+            os.makedirs(d)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_jobs(self, names, type='HORIZONTAL_OFFSET'):
+        jobs = []
+        for name in names:
+            filename = os.path.join(self.source_dir, name)
+            with open(filename, 'w') as f:
+                f.write(name)
+            row = {'filename': name, 'type': type, 'area': 'area', 'unit': '',
+                   'source_crs': 'EPSG:4326', 'target_crs': 'EPSG:4326',
+                   'interpolation_crs': '', 'agency_name': 'agency',
+                   'source': 'source', 'licence': 'licence'}
+            jobs.append((filename, row))
+        return jobs
+
+    def run_process_rows(self, jobs, converter, **kwargs):
+        """ Run process_rows() with converter for all grid types, and fail
+            if it does not return in a reasonable time. """
+
+        handlers = dict((type, (converter, set_specific_args))
+                        for type, (_, set_specific_args) in convert_all.HANDLERS.items())
+        result = []
+
+        def run():
+            result.append(convert_all.process_rows(
+                jobs, self.target_dir, False, '2020:01:01 00:00:00',
+                self.scratch_dir, self.fallback_dir, **kwargs))
+
+        with mock.patch.dict(convert_all.HANDLERS, handlers):
+            thread = threading.Thread(target=run, daemon=True)
+            thread.start()
+            thread.join(30)
+        self.assertFalse(thread.is_alive(), 'process_rows() hangs')
+        self.assertEqual(len(result), 1, 'process_rows() raised')
+        return result[0]
+
+    def assertNoTemporaryFiles(self):
+        self.assertEqual(os.listdir(self.scratch_dir), [])
+        self.assertEqual(os.listdir(self.fallback_dir), [])
+
+    def assertConverted(self, statuses, names):
+        self.assertEqual(sorted(statuses),
+                         sorted('Processed ' + os.path.join(self.source_dir, name)
+                                for name in names))
+        for name in names:
+            self.assertTrue(os.path.exists(os.path.join(
+                self.target_dir, 'agency', name[:-len('.gsb')] + '.tif')))
+
+    def assertFailed(self, errors, names, message):
+        self.assertEqual(sorted(filename for filename, _ in errors),
+                         sorted(os.path.join(self.source_dir, name) for name in names))
+        for _, tb in errors:
+            self.assertIn(message, tb)
+        for name in names:
+            self.assertFalse(os.path.exists(os.path.join(
+                self.target_dir, 'agency', name[:-len('.gsb')] + '.tif')))
+
+    def test_all_succeed(self):
+        names = ['a.gsb', 'b.gsb', 'c.gsb', 'd.gsb']
+        statuses, errors = self.run_process_rows(
+            self.make_jobs(names), StubConverter())
+        self.assertConverted(statuses, names)
+        self.assertEqual(errors, [])
+        self.assertNoTemporaryFiles()
+
+    def test_failing_create_batch_of_2(self):
+        statuses, errors = self.run_process_rows(
+            self.make_jobs(['a.gsb', 'b.gsb']), StubConverter(fail_create=['a.gsb']))
+        self.assertConverted(statuses, ['b.gsb'])
+        self.assertFailed(errors, ['a.gsb'], 'create failed')
+        self.assertNoTemporaryFiles()
+
+    def test_failing_create_batch_of_4(self):
+        statuses, errors = self.run_process_rows(
+            self.make_jobs(['a.gsb', 'b.gsb', 'c.gsb', 'd.gsb']),
+            StubConverter(fail_create=['a.gsb']))
+        self.assertConverted(statuses, ['b.gsb', 'c.gsb', 'd.gsb'])
+        self.assertFailed(errors, ['a.gsb'], 'create failed')
+        self.assertNoTemporaryFiles()
+
+    def test_all_creates_fail(self):
+        names = ['a.gsb', 'b.gsb', 'c.gsb', 'd.gsb']
+        statuses, errors = self.run_process_rows(
+            self.make_jobs(names), StubConverter(fail_create=names))
+        self.assertEqual(statuses, [])
+        self.assertFailed(errors, names, 'create failed')
+        self.assertNoTemporaryFiles()
+
+    def test_failing_optimize_and_check_remove_output(self):
+        statuses, errors = self.run_process_rows(
+            self.make_jobs(['a.gsb', 'b.gsb', 'c.gsb', 'd.gsb']),
+            StubConverter(fail_optimize=['b.gsb'], fail_check=['c.gsb']))
+        self.assertConverted(statuses, ['a.gsb', 'd.gsb'])
+        tracebacks = dict(errors)
+        self.assertFailed([(filename, tb) for filename, tb in errors if filename.endswith('b.gsb')],
+                          ['b.gsb'], 'optimize failed')
+        self.assertFailed([(filename, tb) for filename, tb in errors if filename.endswith('c.gsb')],
+                          ['c.gsb'], 'check failed')
+        self.assertEqual(len(tracebacks), 2)
+        self.assertNoTemporaryFiles()
+
+    def test_failing_prepare(self):
+        # set_vertical_to_vertical_args() only accepts vertcon and NZVD2016 grids
+        jobs = self.make_jobs(['a.gsb']) + self.make_jobs(
+            ['bad.gtx'], type='VERTICAL_OFFSET_VERTICAL_TO_VERTICAL')
+        statuses, errors = self.run_process_rows(jobs, StubConverter())
+        self.assertConverted(statuses, ['a.gsb'])
+        self.assertEqual([filename for filename, _ in errors],
+                         [os.path.join(self.source_dir, 'bad.gtx')])
+        self.assertIn('AssertionError', errors[0][1])
+        self.assertNoTemporaryFiles()
+
+    def test_scratch_dir_failure_falls_back(self):
+        class ScratchFullConverter(StubConverter):
+            def create_unoptimized_file(converter, src, tmpfilename, args):
+                if tmpfilename.startswith(self.scratch_dir):
+                    raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC), tmpfilename)
+                StubConverter.create_unoptimized_file(converter, src, tmpfilename, args)
+
+        names = ['a.gsb', 'b.gsb']
+        statuses, errors = self.run_process_rows(
+            self.make_jobs(names), ScratchFullConverter())
+        self.assertConverted(statuses, names)
+        self.assertEqual(errors, [])
+        self.assertNoTemporaryFiles()
+
+    def test_failing_create_does_not_fall_back(self):
+        class CountingConverter(StubConverter):
+            def create_unoptimized_file(converter, src, tmpfilename, args):
+                tmpfilenames.append(tmpfilename)
+                StubConverter.create_unoptimized_file(converter, src, tmpfilename, args)
+
+        tmpfilenames = []
+        statuses, errors = self.run_process_rows(
+            self.make_jobs(['a.gsb']), CountingConverter(fail_create=['a.gsb']))
+        self.assertEqual(statuses, [])
+        self.assertFailed(errors, ['a.gsb'], 'create failed')
+        self.assertEqual(len(tmpfilenames), 1)
+        self.assertTrue(tmpfilenames[0].startswith(self.scratch_dir))
+        self.assertNoTemporaryFiles()
+
+    def test_scratch_dir_reservation(self):
+        class RecordingConverter(StubConverter):
+            def create_unoptimized_file(converter, src, tmpfilename, args):
+                tmpfilenames.append(tmpfilename)
+                StubConverter.create_unoptimized_file(converter, src, tmpfilename, args)
+
+        # Room for twice the size of a.gsb, but not for another file of
+        # the same size being written by the other worker
+        disk_usage = mock.Mock(return_value=types.SimpleNamespace(free=15))
+        for other_worker_tmpfiles, expected_dir in (([], self.scratch_dir),
+                                                    (['other.tmp'], self.fallback_dir)):
+            for name in other_worker_tmpfiles:
+                open(os.path.join(self.scratch_dir, name), 'w').close()
+            tmpfilenames = []
+            with mock.patch('shutil.disk_usage', disk_usage):
+                statuses, errors = self.run_process_rows(
+                    self.make_jobs(['a.gsb']), RecordingConverter(), processes=2)
+            self.assertEqual(errors, [])
+            self.assertEqual([os.path.dirname(filename) for filename in tmpfilenames],
+                             [expected_dir])
+            for name in other_worker_tmpfiles:
+                os.remove(os.path.join(self.scratch_dir, name))
+            os.remove(os.path.join(self.target_dir, 'agency', 'a.tif'))
+            self.assertNoTemporaryFiles()
+
+    def test_profile(self):
+        profile_dir = os.path.join(self.tmpdir, 'profile')
+        os.makedirs(profile_dir)
+        names = ['a.gsb', 'b.gsb']
+        statuses, errors = self.run_process_rows(
+            self.make_jobs(names), StubConverter(fail_create=['b.gsb']),
+            profile_dir=profile_dir)
+        self.assertConverted(statuses, ['a.gsb'])
+        self.assertFailed(errors, ['b.gsb'], 'create failed')
+        self.assertEqual(sorted(os.listdir(profile_dir)),
+                         ['HORIZONTAL_OFFSET.agency_a.gsb.prof',
+                          'HORIZONTAL_OFFSET.agency_b.gsb.prof'])
+        self.assertNoTemporaryFiles()
+
+
+class TestIndexGrids(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        # north-america and oceania are missing
+        for name in ('a.gsb', 'europe/a.gsb', 'europe/b.gsb', 'world/c.gtx'):
+            filename = os.path.join(self.tmpdir, name)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            open(filename, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_earlier_subdirectory_wins(self):
+        grid_index = convert_all.index_grids(self.tmpdir)
+        self.assertEqual(grid_index['a.gsb'], os.path.join(self.tmpdir, '.', 'a.gsb'))
+
+    def test_missing_subdirectory_is_skipped(self):
+        grid_index = convert_all.index_grids(self.tmpdir)
+        self.assertEqual(grid_index['b.gsb'], os.path.join(self.tmpdir, 'europe', 'b.gsb'))
+        self.assertEqual(grid_index['c.gtx'], os.path.join(self.tmpdir, 'world', 'c.gtx'))
+
+
+class TestMain(unittest.TestCase):
+
+    HEADER = 'filename,type,area,unit,source_crs,target_crs,interpolation_crs,agency_name,source,licence\n'
+    ROW = 'a.gsb,HORIZONTAL_OFFSET,area,,EPSG:4326,EPSG:4326,,agency,source,licence\n'
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filelist = os.path.join(self.tmpdir, 'filelist.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertInvalidRow(self, row):
+        with open(self.filelist, 'w') as f:
+            f.write(self.HEADER + self.ROW + row)
+        with self.assertRaises(ValueError) as cm:
+            convert_all.main([self.tmpdir, os.path.join(self.tmpdir, 'target')])
+        self.assertIn(self.filelist + ':3:', str(cm.exception))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'target')))
+
+    def test_short_row(self):
+        self.assertInvalidRow('b.gsb,HORIZONTAL_OFFSET,area,,EPSG:4326,EPSG:4326,,agency,source\n')
+
+    def test_long_row(self):
+        self.assertInvalidRow(self.ROW.replace('licence', 'licence,extra'))
+
+
+if __name__ == '__main__':
+    unittest.main()